@@ -2,19 +2,34 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import argparse
+import ast
 import asyncio
+import builtins
+import code
+import concurrent.futures
 import importlib
+import inspect
+import itertools
 import os
 import os.path
+import shlex
+import signal
 import sys
-import time
+import threading
+import types
 
-from typing import Callable
+from typing import Callable, Optional
 
 import denonavr
 import denonavr.exceptions
+import httpx
 
 import denonavr_cli
+import denonavr_cli.exporter
+import denonavr_cli.mqtt
+import denonavr_cli.scan
+import denonavr_cli.state
+import denonavr_cli.transport
 
 
 async def wait_for_update(avr: denonavr.DenonAVR,
@@ -32,15 +47,206 @@ async def wait_for_update(avr: denonavr.DenonAVR,
         await avr.async_update()
         if callback():
             return True
-        time.sleep(0.2)
+        await asyncio.sleep(0.2)
     return False
 
 
+async def refresh_periodically(avr: denonavr.DenonAVR,
+                               interval: float,
+                               snapshot: Optional[
+                                   denonavr_cli.state.StateSnapshot] = None,
+                               ) -> None:
+    """Update AVR status every interval seconds, reporting errors"""
+
+    while True:
+        await asyncio.sleep(interval)
+        # catch everything, so that the refresh task does not die
+        try:
+            await avr.async_update()
+            if snapshot is not None:
+                snapshot.save(avr)
+        except Exception as e:
+            print(f"Status update failed: {e!r}", file=sys.stderr)
+
+
+def positive_float(value: str) -> float:
+    """Parse a positive float (argparse type)"""
+
+    ret = float(value)
+    if not ret > 0:
+        raise argparse.ArgumentTypeError(f"must be positive: {value}")
+    return ret
+
+
+class AsyncioConsole(code.InteractiveConsole):
+    """
+    Interactive console supporting top-level await and subcommands
+
+    The console is meant to be run in a separate thread.  All code
+    (as well as subcommands) is executed in the event loop owning
+    the AVR connection, and the console thread waits for the result.
+    """
+
+    def __init__(self,
+                 avr: denonavr.DenonAVR,
+                 loop: asyncio.AbstractEventLoop,
+                 commands: list,
+                 snapshot: Optional[
+                     denonavr_cli.state.StateSnapshot] = None,
+                 ) -> None:
+        super().__init__({
+            "__name__": "__console__",
+            "__doc__": None,
+            "__builtins__": builtins,
+            "asyncio": asyncio,
+            "avr": avr,
+        })
+        self.compile.compiler.flags |= ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+        self.avr = avr
+        self.loop = loop
+        self.snapshot = snapshot
+        self.future = None
+
+        self.commands = {}
+        for cmd_class in commands:
+            argp = argparse.ArgumentParser(prog=command_name(cmd_class),
+                                           description=cmd_class.__doc__)
+            cmd_class.add_arguments(argp)
+            self.commands[argp.prog] = (argp, cmd_class)
+
+    def run_in_loop(self, coro) -> None:
+        """Run coroutine in the event loop and wait for it to finish"""
+
+        async def wrapper():
+            # SystemExit would break out of the event loop, so pass it
+            # back to our thread instead
+            try:
+                await coro
+            except SystemExit as e:
+                return e
+
+        self.future = asyncio.run_coroutine_threadsafe(wrapper(), self.loop)
+        try:
+            exc = self.future.result()
+        finally:
+            self.future = None
+        if exc is not None:
+            raise exc
+
+    def interrupt(self) -> None:
+        """Cancel the running command (SIGINT handler)"""
+
+        future = self.future
+        if future is not None:
+            future.cancel()
+        else:
+            self.write("\nKeyboardInterrupt (use Ctrl-D to exit)\n")
+
+    def invalidate_snapshot(self) -> None:
+        """Invalidate state snapshot after a possible state change"""
+
+        if self.snapshot is not None:
+            try:
+                self.snapshot.invalidate()
+            except OSError as e:
+                self.write(f"Unable to remove state snapshot: {e}\n")
+
+    def interact(self, banner=None, exitmsg=None) -> None:
+        try:
+            super().interact(banner=banner, exitmsg=exitmsg)
+        except SystemExit:
+            pass
+
+    def runsource(self, source, filename="<input>", symbol="single") -> bool:
+        try:
+            words = shlex.split(source)
+        except ValueError:
+            words = []
+        # "volume = ...", "volume.real", "input(...)" etc. are Python
+        if (words and words[0] in self.commands and
+                (len(words) == 1 or words[1][:1] not in "=.([")):
+            argp, cmd_class = self.commands[words[0]]
+            try:
+                args = argp.parse_args(words[1:])
+                try:
+                    self.run_in_loop(cmd_class.run(self.avr, argp, args))
+                finally:
+                    if not cmd_class.read_only(args):
+                        self.invalidate_snapshot()
+            except SystemExit:
+                pass
+            except concurrent.futures.CancelledError:
+                self.write("KeyboardInterrupt\n")
+            except Exception:
+                self.showtraceback()
+            return False
+        return super().runsource(source, filename, symbol)
+
+    def runcode(self, code) -> None:
+        func = types.FunctionType(code, self.locals)
+
+        async def run():
+            ret = func()
+            if inspect.iscoroutine(ret):
+                await ret
+
+        try:
+            try:
+                self.run_in_loop(run())
+            finally:
+                # user code may have changed AVR state
+                self.invalidate_snapshot()
+        except SystemExit:
+            raise
+        except concurrent.futures.CancelledError:
+            self.write("KeyboardInterrupt\n")
+        except BaseException as e:
+            # strip the frames of run_in_loop() and the future machinery,
+            # so that the traceback starts at the user's code
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code is not code:
+                tb = tb.tb_next
+            try:
+                raise e.with_traceback(tb or e.__traceback__)
+            except BaseException:
+                self.showtraceback()
+
+
 class Subcommand:
     @staticmethod
     def add_arguments(subc):
         pass
 
+    @staticmethod
+    def read_only(args):
+        """Whether the command can be served from the state snapshot"""
+        return False
+
+
+class exporter(Subcommand):
+    """Serve AVR state as Prometheus metrics"""
+
+    @staticmethod
+    def add_arguments(subc):
+        subc.add_argument("-a", "--address",
+                          default="localhost",
+                          help="Address to listen on (default: localhost)")
+        subc.add_argument("-i", "--interval",
+                          type=positive_float,
+                          default=15.0,
+                          help="Interval between status updates, "
+                               "in seconds (default: 15)")
+        subc.add_argument("-p", "--port",
+                          type=int,
+                          default=9823,
+                          help="Port to listen on (default: 9823)")
+
+    @staticmethod
+    async def run(avr, argp, args):
+        metrics = denonavr_cli.exporter.Metrics(avr, args.snapshot)
+        await metrics.serve(args.address, args.port, args.interval)
+        return 0
+
 
 class input(Subcommand):
     """Print and control inputs"""
@@ -54,6 +260,10 @@ class input(Subcommand):
                           nargs="?",
                           help="Switch to another input")
 
+    @staticmethod
+    def read_only(args):
+        return args.new_input is None
+
     @staticmethod
     async def run(avr, argp, args):
         if args.list:
@@ -81,6 +291,10 @@ class mute(Subcommand):
                           nargs="?",
                           help="Requested state change")
 
+    @staticmethod
+    def read_only(args):
+        return args.new_state is None
+
     @staticmethod
     async def run(avr, argp, args):
         if args.new_state is not None:
@@ -92,6 +306,78 @@ class mute(Subcommand):
         return 0
 
 
+class mqtt(Subcommand):
+    """Bridge AVR control and state to an MQTT broker"""
+
+    @staticmethod
+    def add_arguments(subc):
+        subc.add_argument("-b", "--broker",
+                          default="localhost",
+                          help="MQTT broker host (default: localhost)")
+        subc.add_argument("-d", "--debounce",
+                          type=float,
+                          default=0.3,
+                          help="Time to wait for further commands before "
+                               "executing, in seconds (default: 0.3)")
+        subc.add_argument("-i", "--interval",
+                          type=positive_float,
+                          default=10.0,
+                          help="Interval between status updates, "
+                               "in seconds (default: 10)")
+        subc.add_argument("-p", "--port",
+                          type=int,
+                          default=1883,
+                          help="MQTT broker port (default: 1883)")
+        subc.add_argument("-t", "--topic-prefix",
+                          default="denonavr",
+                          help="Prefix for MQTT topics (default: denonavr)")
+        subc.add_argument("-u", "--username",
+                          help="Username for the MQTT broker")
+        subc.add_argument("--password",
+                          help="Password for the MQTT broker")
+
+    @staticmethod
+    async def run(avr, argp, args):
+        try:
+            aiomqtt = importlib.import_module("aiomqtt")
+        except ImportError:
+            argp.error("mqtt command requires the aiomqtt package")
+
+        available_topic = f"{args.topic_prefix}/available"
+        will = aiomqtt.Will(available_topic, "offline", qos=1, retain=True)
+        async with aiomqtt.Client(args.broker, args.port,
+                                  username=args.username,
+                                  password=args.password,
+                                  will=will) as client:
+            bridge = denonavr_cli.mqtt.Bridge(avr, client, args.topic_prefix,
+                                              args.debounce, args.snapshot)
+            # subscribe first, so that commands sent after seeing
+            # the availability announcement are not lost
+            await client.subscribe(f"{args.topic_prefix}/+/set", qos=1)
+            await client.publish(available_topic, "online", qos=1,
+                                 retain=True)
+            await bridge.publish_state()
+            refresh = asyncio.ensure_future(
+                bridge.refresh_periodically(args.interval))
+            try:
+                async for message in client.messages:
+                    payload = message.payload
+                    if isinstance(payload, (bytes, bytearray)):
+                        payload = payload.decode("utf-8", "replace")
+                    bridge.handle_message(message.topic.value, str(payload))
+            finally:
+                refresh.cancel()
+                bridge.cancel_pending()
+                # the will is only sent on an unexpected disconnect
+                try:
+                    await client.publish(available_topic, "offline", qos=1,
+                                         retain=True)
+                except Exception as e:
+                    print(f"Unable to publish availability: {e!r}",
+                          file=sys.stderr)
+        return 0
+
+
 class power(Subcommand):
     """Print and control power"""
 
@@ -102,6 +388,10 @@ class power(Subcommand):
                           nargs="?",
                           help="Requested state change")
 
+    @staticmethod
+    def read_only(args):
+        return args.new_state is None
+
     @staticmethod
     async def run(avr, argp, args):
         if args.new_state is not None:
@@ -121,23 +411,23 @@ class shell(Subcommand):
 
     @staticmethod
     def add_arguments(subc):
+        subc.add_argument("-r", "--refresh-interval",
+                          type=float,
+                          default=5.0,
+                          help="Interval between background status updates "
+                               "in the Python shell, in seconds (0 disables, "
+                               "default: 5; not supported by IPython shell)")
         subc.add_argument("-s", "--shell",
                           choices=("ipython", "python"),
-                          help="Shell to use (default: autodetect)")
+                          default="python",
+                          help="Shell to use (default: python, an asyncio "
+                               "console supporting top-level await "
+                               "and commands)")
 
     @staticmethod
     async def run(avr, argp, args):
         BANNER = 'The AVR connection is available as "avr" object'
 
-        if args.shell is None:
-            try:
-                importlib.import_module("IPython")
-                importlib.import_module("nest_asyncio")
-            except ImportError:
-                args.shell = "python"
-            else:
-                args.shell = "ipython"
-
         if args.shell == "ipython":
             IPython = importlib.import_module("IPython")
             nest_asyncio = importlib.import_module("nest_asyncio")
@@ -147,9 +437,41 @@ class shell(Subcommand):
             return 0
 
         if args.shell == "python":
-            code = importlib.import_module("code")
-
-            code.InteractiveConsole({"avr": avr}).interact(banner=BANNER)
+            loop = asyncio.get_running_loop()
+            console = AsyncioConsole(
+                avr, loop,
+                [x for x in COMMANDS if x not in (exporter, mqtt, shell)],
+                snapshot=args.snapshot)
+            done = loop.create_future()
+
+            def console_thread():
+                try:
+                    console.interact(
+                        banner=f"{BANNER}\n"
+                               "Top-level await is supported, and commands "
+                               "can be used directly, e.g. \"volume up 2\"")
+                finally:
+                    loop.call_soon_threadsafe(done.set_result, None)
+
+            refresh = None
+            if args.refresh_interval > 0:
+                refresh = asyncio.ensure_future(
+                    refresh_periodically(avr, args.refresh_interval,
+                                         args.snapshot))
+            try:
+                loop.add_signal_handler(signal.SIGINT, console.interrupt)
+            except (NotImplementedError, RuntimeError):
+                pass
+            try:
+                threading.Thread(target=console_thread, daemon=True).start()
+                await done
+            finally:
+                try:
+                    loop.remove_signal_handler(signal.SIGINT)
+                except (NotImplementedError, RuntimeError):
+                    pass
+                if refresh is not None:
+                    refresh.cancel()
             return 0
 
 
@@ -167,6 +489,10 @@ class volume(Subcommand):
                           type=float,
                           help="New value or adjustment")
 
+    @staticmethod
+    def read_only(args):
+        return args.action is None
+
     @staticmethod
     async def run(avr, argp, args):
         if args.action is not None:
@@ -202,6 +528,10 @@ class sound_mode(Subcommand):
                           nargs="?",
                           help="Switch to another sound mode")
 
+    @staticmethod
+    def read_only(args):
+        return args.new_mode is None
+
     @staticmethod
     async def run(avr, argp, args):
         if args.list:
@@ -220,8 +550,15 @@ class sound_mode(Subcommand):
         return 0
 
 
+COMMANDS = [exporter, input, mqtt, mute, power, shell, volume, sound_mode]
+
+
+def command_name(cmd_class):
+    return cmd_class.__name__.replace("_", "-")
+
+
 def add_subcommand(subp, cmd_class):
-    subc = subp.add_parser(cmd_class.__name__.replace("_", "-"),
+    subc = subp.add_parser(command_name(cmd_class),
                            help=cmd_class.__doc__)
     cmd_class.add_arguments(subc)
 
@@ -235,21 +572,53 @@ async def main(argv):
                       choices=("off", "on", "reset"),
                       default="on",
                       help="Whether to cache the last used hostname "
-                           "(or reset the cached value)")
+                           "and receiver state (or reset the cached values)")
+    argp.add_argument("--max-age",
+                      type=float,
+                      metavar="SECONDS",
+                      help="Answer status queries from the cached receiver "
+                           "state if it is not older than SECONDS")
     argp.add_argument("-V", "--version",
                       action="store_true",
                       help="Print version and exit")
+    record_group = argp.add_mutually_exclusive_group()
+    record_group.add_argument("--record",
+                              metavar="FILE",
+                              help="Record HTTP traffic with the receiver "
+                                   "into FILE")
+    record_group.add_argument("--replay",
+                              metavar="FILE",
+                              help="Replay HTTP traffic from FILE instead "
+                                   "of connecting to the receiver (implies "
+                                   "--host-cache=off)")
+    argp.add_argument("--replay-timing",
+                      action="store_true",
+                      help="Reproduce recorded response latencies "
+                           "when replaying")
 
     subp = argp.add_subparsers(title="commands",
                                dest="command")
-    subp.add_parser("discover",
-                    help="Print autodiscovered receivers and exit")
-    add_subcommand(subp, input)
-    add_subcommand(subp, mute)
-    add_subcommand(subp, power)
-    add_subcommand(subp, shell)
-    add_subcommand(subp, volume)
-    add_subcommand(subp, sound_mode)
+    discover_parser = subp.add_parser(
+        "discover",
+        help="Print autodiscovered receivers and exit")
+    discover_parser.add_argument("--hosts-file",
+                                 metavar="FILE",
+                                 help="Scan hosts listed in FILE (one per "
+                                      "line) instead of using SSDP")
+    discover_parser.add_argument("--scan",
+                                 action="append",
+                                 metavar="CIDR",
+                                 type=denonavr_cli.scan.network,
+                                 help="Scan all addresses in the specified "
+                                      "network instead of using SSDP "
+                                      "(can be specified multiple times)")
+    discover_parser.add_argument("--timeout",
+                                 type=float,
+                                 default=0.5,
+                                 help="Connection timeout for scanning, "
+                                      "in seconds (default: 0.5)")
+    for cmd_class in COMMANDS:
+        add_subcommand(subp, cmd_class)
 
     args = argp.parse_args(argv[1:])
 
@@ -257,17 +626,77 @@ async def main(argv):
         print(f"denonavr-cli {denonavr_cli.__version__}")
         return 0
 
+    if args.replay is None:
+        if args.replay_timing:
+            argp.error("--replay-timing requires --replay")
+    elif args.command == "discover":
+        argp.error("discover cannot be used with --replay")
+
+    transport = None
+    if args.record is not None:
+        transport = denonavr_cli.transport.RecordingTransport()
+    elif args.replay is not None:
+        try:
+            recording = denonavr_cli.transport.load_recording(args.replay)
+            transport = denonavr_cli.transport.ReplayTransport(
+                recording["exchanges"], timing=args.replay_timing)
+            if args.host is None:
+                args.host = recording["host"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            argp.error(f"Unable to load recording from {args.replay}: {e!r}")
+        args.host_cache = "off"
+
+    if transport is None:
+        return await run(argp, args, denonavr.DenonAVR)
+
+    client = httpx.AsyncClient(transport=transport)
+
+    def create_avr(host):
+        avr = denonavr.DenonAVR(host)
+        avr.set_async_client_getter(lambda: client)
+        return avr
+
+    try:
+        return await run(argp, args, create_avr)
+    finally:
+        await client.aclose()
+        if args.record is not None:
+            transport.save(args.record, args.host)
+
+
+async def run(argp, args, create_avr):
     xdg_cache_home = os.path.expanduser(
         os.getenv("XDG_CACHE_HOME", "~/.cache"))
     host_cache = os.path.join(xdg_cache_home, "denonavr-cli.host")
+    state_cache = os.path.join(xdg_cache_home, "denonavr-cli.state")
 
     avr = None
     discover = args.command == "discover"
+    command_class = None
+    if args.command is not None and not discover:
+        command_class = globals()[args.command.replace("-", "_")]
+    read_only = command_class is None or command_class.read_only(args)
+
+    if (args.max_age is not None and not discover and read_only and
+            args.host_cache != "reset"):
+        host = args.host
+        if host is None and args.host_cache == "on":
+            try:
+                with open(host_cache, "r") as f:
+                    host = f.read().strip()
+            except OSError:
+                pass
+        if host is not None:
+            state = denonavr_cli.state.load_state(state_cache, host,
+                                                  args.max_age)
+            if state is not None:
+                return await run_command(state, argp, args, command_class)
+
     if not discover and args.host_cache == "on":
         try:
             with open(host_cache, "r") as f:
                 host = f.read().strip()
-            try_avr = denonavr.DenonAVR(host)
+            try_avr = create_avr(host)
             await try_avr.async_setup()
         except FileNotFoundError:
             pass
@@ -278,7 +707,26 @@ async def main(argv):
             args.host = host
             avr = try_avr
     if args.host is None or discover:
-        avrs = await denonavr.async_discover()
+        if discover and (args.scan or args.hosts_file):
+            hosts = []
+            for network in args.scan or []:
+                if (network.num_addresses >
+                        denonavr_cli.scan.MAX_SCAN_ADDRESSES):
+                    argp.error(f"Network {network} is too large to scan "
+                               f"(at most "
+                               f"{denonavr_cli.scan.MAX_SCAN_ADDRESSES} "
+                               f"addresses are supported)")
+                hosts.append(network.hosts())
+            if args.hosts_file is not None:
+                try:
+                    hosts.append(
+                        denonavr_cli.scan.read_hosts_file(args.hosts_file))
+                except OSError as e:
+                    argp.error(f"Unable to read hosts file: {e}")
+            hosts = itertools.chain.from_iterable(hosts)
+            avrs = await denonavr_cli.scan.async_scan(hosts, args.timeout)
+        else:
+            avrs = await denonavr.async_discover()
         if not avrs:
             if discover:
                 print("No AVRs discovered", file=sys.stderr)
@@ -300,16 +748,29 @@ async def main(argv):
         args.host = avrs[0]["host"]
 
     if avr is None:
-        avr = denonavr.DenonAVR(args.host)
+        avr = create_avr(args.host)
         await avr.async_setup()
     await avr.async_update()
 
+    args.snapshot = denonavr_cli.state.StateSnapshot(
+        state_cache, args.host, args.host_cache != "off")
     if args.host_cache != "off":
         with open(host_cache, "w") as f:
             f.write(f"{args.host}\n")
+    if read_only:
+        args.snapshot.save(avr)
 
-    if args.command is not None:
-        command_class = globals()[args.command.replace("-", "_")]
+    try:
+        return await run_command(avr, argp, args, command_class)
+    finally:
+        # invalidate even with host cache disabled, to avoid leaving
+        # stale state for --max-age readers
+        if not read_only:
+            args.snapshot.invalidate()
+
+
+async def run_command(avr, argp, args, command_class):
+    if command_class is not None:
         return await command_class.run(avr, argp, args)
 
     print(f"Power: {avr.power:7}  Volume: {avr.volume:5} dB "
@@ -0,0 +1,185 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Prometheus exporter for AVR state"""
+
+import asyncio
+import collections
+import sys
+import time
+import typing
+
+import denonavr
+
+import denonavr_cli.state
+
+
+UPDATE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label(value: str) -> str:
+    """Escape label value for the text exposition format"""
+    return (value.replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n"))
+
+
+class Metrics:
+    """Cached AVR state and update statistics"""
+
+    def __init__(self,
+                 avr: denonavr.DenonAVR,
+                 snapshot: typing.Optional[
+                     denonavr_cli.state.StateSnapshot] = None,
+                 ) -> None:
+        self.avr = avr
+        self.snapshot = snapshot
+        self.up = True
+        self.last_update = time.time()
+        self.update_buckets = [0] * len(UPDATE_BUCKETS)
+        self.update_count = 0
+        self.update_sum = 0.0
+        self.update_errors = collections.Counter()
+
+    def observe_update(self, duration: float) -> None:
+        """Record update duration in the histogram"""
+
+        for i, bound in enumerate(UPDATE_BUCKETS):
+            if duration <= bound:
+                self.update_buckets[i] += 1
+        self.update_count += 1
+        self.update_sum += duration
+
+    async def update(self) -> None:
+        """Update AVR state, recording latency and errors"""
+
+        start = time.perf_counter()
+        try:
+            await self.avr.async_update()
+        except Exception as e:
+            # catch everything, so that the refresh task does not die
+            # leaving stale values behind
+            self.up = False
+            self.update_errors[type(e).__name__] += 1
+        else:
+            self.up = True
+            self.last_update = time.time()
+        finally:
+            self.observe_update(time.perf_counter() - start)
+
+        if self.up and self.snapshot is not None:
+            try:
+                self.snapshot.save(self.avr)
+            except OSError as e:
+                print(f"Unable to save state snapshot: {e}", file=sys.stderr)
+
+    async def refresh_periodically(self, interval: float) -> None:
+        """Update AVR state every interval seconds"""
+
+        while True:
+            await asyncio.sleep(interval)
+            await self.update()
+
+    def render(self) -> str:
+        """Render metrics in the Prometheus text exposition format"""
+
+        avr = self.avr
+        lines = []
+
+        def metric(name, mtype, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {mtype}")
+            for suffix, labels, value in samples:
+                if labels:
+                    label_str = ",".join(
+                        f'{k}="{escape_label(str(v))}"'
+                        for k, v in labels.items())
+                    label_str = f"{{{label_str}}}"
+                else:
+                    label_str = ""
+                lines.append(f"{name}{suffix}{label_str} {value}")
+
+        metric("denonavr_up", "gauge",
+               "Whether the last status update succeeded",
+               [("", {}, int(self.up))])
+        metric("denonavr_last_update_timestamp_seconds", "gauge",
+               "Time of the last successful status update",
+               [("", {}, self.last_update)])
+        metric("denonavr_power", "gauge",
+               "Whether the receiver is powered on",
+               [("", {}, int(avr.power == "ON"))])
+        if avr.volume is not None:
+            metric("denonavr_volume_db", "gauge",
+                   "Volume in dB",
+                   [("", {}, avr.volume)])
+        metric("denonavr_muted", "gauge",
+               "Whether the receiver is muted",
+               [("", {}, int(bool(avr.muted)))])
+        if avr.input_func is not None:
+            metric("denonavr_input_info", "gauge",
+                   "Current input",
+                   [("", {"input": avr.input_func}, 1)])
+        if avr.sound_mode is not None:
+            metric("denonavr_sound_mode_info", "gauge",
+                   "Current sound mode",
+                   [("", {"sound_mode": avr.sound_mode}, 1)])
+        metric("denonavr_update_duration_seconds", "histogram",
+               "Duration of status updates",
+               [("_bucket", {"le": bound}, count)
+                for bound, count in zip(UPDATE_BUCKETS, self.update_buckets)]
+               + [("_bucket", {"le": "+Inf"}, self.update_count),
+                  ("_sum", {}, self.update_sum),
+                  ("_count", {}, self.update_count)])
+        metric("denonavr_update_errors_total", "counter",
+               "Number of failed status updates, by exception type",
+               [("", {"type": k}, v)
+                for k, v in sorted(self.update_errors.items())])
+
+        return "\n".join(lines) + "\n"
+
+    async def handle_request(self,
+                             reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter,
+                             ) -> None:
+        """Handle a single HTTP request"""
+
+        try:
+            request_line = await reader.readline()
+            # skip headers
+            while (await reader.readline()).strip():
+                pass
+
+            request = request_line.decode("latin1").split()
+            if len(request) < 2 or request[0] not in ("GET", "HEAD"):
+                status = "405 Method Not Allowed"
+                body = b""
+            elif request[1].split("?", 1)[0] != "/metrics":
+                status = "404 Not Found"
+                body = b""
+            else:
+                status = "200 OK"
+                body = self.render().encode("utf-8")
+
+            writer.write(
+                f"HTTP/1.0 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n"
+                "\r\n".encode("latin1"))
+            if request[:1] != ["HEAD"]:
+                writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int, interval: float) -> None:
+        """Serve metrics over HTTP, refreshing AVR state in background"""
+
+        server = await asyncio.start_server(self.handle_request, host, port)
+        refresh = asyncio.ensure_future(self.refresh_periodically(interval))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresh.cancel()
@@ -0,0 +1,208 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""MQTT bridge for AVR control"""
+
+import asyncio
+import math
+import sys
+import typing
+
+import denonavr
+
+import denonavr_cli.state
+
+
+# denonavr changes volume by 0.5 dB on volume up/down
+VOLUME_STEP = 0.5
+
+BOOLEAN_VALUES = {
+    "on": True,
+    "true": True,
+    "1": True,
+    "off": False,
+    "false": False,
+    "0": False,
+}
+
+
+def parse_finite(value: str) -> float:
+    """Parse float value, rejecting infinity and NaN"""
+
+    ret = float(value)
+    if not math.isfinite(ret):
+        raise ValueError(f"Value not finite: {value}")
+    return ret
+
+
+class Bridge:
+    """
+    MQTT bridge for a single AVR
+
+    Commands are received on "<prefix>/<command>/set" topics.  Commands
+    arriving within the debounce interval are coalesced, and executed
+    one at a time.  AVR state is published on "<prefix>/<command>"
+    retained topics whenever it changes, in the same format as printed
+    by the respective CLI commands.
+    """
+
+    COMMANDS = ("input", "mute", "power", "sound-mode", "volume")
+
+    def __init__(self,
+                 avr: denonavr.DenonAVR,
+                 client: typing.Any,
+                 prefix: str,
+                 debounce: float,
+                 snapshot: typing.Optional[
+                     denonavr_cli.state.StateSnapshot] = None,
+                 ) -> None:
+        self.avr = avr
+        self.snapshot = snapshot
+        self.client = client
+        self.prefix = prefix
+        self.debounce = debounce
+        self.lock = asyncio.Lock()
+        self.pending = {}
+        self.timers = {}
+        self.published = {}
+
+    def get_state(self) -> typing.Dict[str, str]:
+        """Get current AVR state as topic-payload mapping"""
+
+        return {
+            f"{self.prefix}/input": str(self.avr.input_func),
+            f"{self.prefix}/mute": str(self.avr.muted),
+            f"{self.prefix}/power": str(self.avr.power),
+            f"{self.prefix}/sound-mode": str(self.avr.sound_mode),
+            f"{self.prefix}/volume": str(self.avr.volume),
+        }
+
+    async def publish_state(self) -> None:
+        """Publish state topics whose values changed"""
+
+        for topic, payload in self.get_state().items():
+            if self.published.get(topic) != payload:
+                await self.client.publish(topic, payload, qos=1, retain=True)
+                self.published[topic] = payload
+
+    async def update(self) -> None:
+        """Update AVR state and publish changes"""
+
+        async with self.lock:
+            # catch everything, so that the refresh task does not die
+            try:
+                await self.avr.async_update()
+                await self.publish_state()
+                if self.snapshot is not None:
+                    self.snapshot.save(self.avr)
+            except Exception as e:
+                print(f"Update failed: {e!r}", file=sys.stderr)
+
+    async def refresh_periodically(self, interval: float) -> None:
+        """Update AVR state every interval seconds"""
+
+        while True:
+            await asyncio.sleep(interval)
+            await self.update()
+
+    def parse_boolean(self, command: str, payload: str) -> bool:
+        """Parse boolean payload, resolving toggle against pending state"""
+
+        if payload == "toggle":
+            if command in self.pending:
+                return not self.pending[command]
+            if command == "power":
+                return self.avr.power != "ON"
+            return not self.avr.muted
+        return BOOLEAN_VALUES[payload]
+
+    def parse_volume(self, payload: str) -> typing.Tuple[str, float]:
+        """Parse volume payload, coalescing it with the pending change"""
+
+        action, _, value = payload.partition(" ")
+        if action not in ("down", "set", "up"):
+            action, value = "set", payload
+        if action == "set":
+            return ("set", parse_finite(value))
+
+        delta = parse_finite(value) if value else VOLUME_STEP
+        if action == "down":
+            delta *= -1
+        pending_action, pending_value = self.pending.get("volume",
+                                                         ("adjust", 0.0))
+        return (pending_action, pending_value + delta)
+
+    def handle_message(self, topic: str, payload: str) -> None:
+        """Handle incoming command message"""
+
+        command = topic[len(self.prefix) + 1:-len("/set")]
+        if (not topic.startswith(f"{self.prefix}/") or
+                not topic.endswith("/set") or
+                command not in self.COMMANDS):
+            return
+
+        payload = payload.strip()
+        try:
+            if command in ("mute", "power"):
+                value = self.parse_boolean(command, payload.lower())
+            elif command == "volume":
+                value = self.parse_volume(payload.lower())
+            else:
+                value = payload
+        except (KeyError, ValueError):
+            print(f"Invalid {command} value: {payload!r}", file=sys.stderr)
+            return
+
+        self.pending[command] = value
+        timer = self.timers.get(command)
+        if timer is not None:
+            timer.cancel()
+        self.timers[command] = asyncio.ensure_future(
+            self.delayed_execute(command))
+
+    async def delayed_execute(self, command: str) -> None:
+        """Execute pending command after the debounce interval"""
+
+        await asyncio.sleep(self.debounce)
+        # from this point on, the command can no longer be superseded
+        del self.timers[command]
+        value = self.pending.pop(command)
+        async with self.lock:
+            # nothing awaits this task, so report all errors here
+            try:
+                try:
+                    await self.execute(command, value)
+                finally:
+                    if self.snapshot is not None:
+                        self.snapshot.invalidate()
+                await self.avr.async_update()
+                await self.publish_state()
+            except Exception as e:
+                print(f"{command} failed: {e!r}", file=sys.stderr)
+
+    async def execute(self, command: str, value: typing.Any) -> None:
+        """Perform the AVR operation for command"""
+
+        avr = self.avr
+        if command == "input":
+            await avr.async_set_input_func(value)
+        elif command == "mute":
+            await avr.async_mute(value)
+        elif command == "power":
+            if value:
+                await avr.async_power_on()
+            else:
+                await avr.async_power_off()
+        elif command == "sound-mode":
+            await avr.async_set_sound_mode(value)
+        elif command == "volume":
+            action, volume = value
+            if action == "adjust":
+                volume += avr.volume
+            await avr.async_set_volume(volume)
+
+    def cancel_pending(self) -> None:
+        """Cancel pending commands"""
+
+        for timer in self.timers.values():
+            timer.cancel()
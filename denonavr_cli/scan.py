@@ -0,0 +1,113 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Unicast scan for AVRs, for networks where SSDP does not work"""
+
+import asyncio
+import ipaddress
+import typing
+
+import denonavr.ssdp
+import httpx
+
+
+# ports and paths of UPnP device descriptions served by receivers
+DESCRIPTION_URLS = [
+    (8080, "/description.xml"),
+    (60006, "/upnp/desc/aios_device/aios_device.xml"),
+]
+SCAN_CONCURRENCY = 256
+# largest network that can be scanned (a /16 for IPv4)
+MAX_SCAN_ADDRESSES = 65536
+DESCRIPTION_TIMEOUT = 2.0
+
+
+def network(value: str,
+            ) -> typing.Union[ipaddress.IPv4Network, ipaddress.IPv6Network]:
+    """Parse network specification (argparse type)"""
+    return ipaddress.ip_network(value, strict=False)
+
+
+def read_hosts_file(path: str) -> typing.List[str]:
+    """Read host list, one host per line, skipping comments"""
+
+    hosts = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                hosts.append(line)
+    return hosts
+
+
+async def probe_port(host: str,
+                     port: int,
+                     timeout: float,
+                     ) -> bool:
+    """Check whether host accepts TCP connections on port"""
+
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def fetch_description(client: httpx.AsyncClient,
+                            host: str,
+                            port: int,
+                            path: str,
+                            ) -> typing.Optional[dict]:
+    """Fetch and parse device description, return None if not an AVR"""
+
+    if ":" in host:
+        host = f"[{host}]"
+    url = f"http://{host}:{port}{path}"
+    try:
+        res = await client.get(url, timeout=DESCRIPTION_TIMEOUT)
+        res.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    return denonavr.ssdp.evaluate_scpd_xml(url, res.text)
+
+
+async def async_scan(hosts: typing.Iterable[str],
+                     timeout: float,
+                     ) -> typing.List[dict]:
+    """
+    Scan specified hosts for AVRs
+
+    Probe description ports on all hosts using a fixed pool
+    of SCAN_CONCURRENCY workers, and fetch descriptions from the hosts
+    that accepted the connection.  Hosts are consumed lazily, so large
+    networks do not need to be expanded in memory.  Returns a list
+    of receivers in the same format as denonavr.async_discover().
+    """
+
+    candidates = enumerate((str(host), port, path)
+                           for host in hosts
+                           for port, path in DESCRIPTION_URLS)
+    found = []
+
+    async def worker(client):
+        # all workers share the iterator; next() does not yield
+        # to the event loop, so no locking is necessary
+        for index, (host, port, path) in candidates:
+            if await probe_port(host, port, timeout):
+                receiver = await fetch_description(client, host, port, path)
+                if receiver is not None:
+                    found.append((index, receiver))
+
+    async with httpx.AsyncClient() as client:
+        await asyncio.gather(*(worker(client)
+                               for i in range(SCAN_CONCURRENCY)))
+
+    receivers = []
+    seen_hosts = set()
+    for index, receiver in sorted(found, key=lambda x: x[0]):
+        if receiver["host"] not in seen_hosts:
+            seen_hosts.add(receiver["host"])
+            receivers.append(receiver)
+    return receivers
@@ -0,0 +1,112 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Local snapshot of AVR state"""
+
+import json
+import os
+import tempfile
+import time
+import types
+import typing
+
+import denonavr
+
+
+STATE_ATTRS = (
+    "input_func",
+    "input_func_list",
+    "muted",
+    "power",
+    "sound_mode",
+    "sound_mode_list",
+    "volume",
+)
+
+
+def save_state(path: str, host: str, avr: denonavr.DenonAVR) -> None:
+    """Save AVR state snapshot atomically"""
+
+    data = {
+        "host": host,
+        "timestamp": time.time(),
+        "state": {k: getattr(avr, k) for k in STATE_ATTRS},
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix=".denonavr-cli.state.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_state(path: str,
+               host: str,
+               max_age: float,
+               ) -> typing.Optional[types.SimpleNamespace]:
+    """
+    Load AVR state snapshot
+
+    Returns an object providing the same state attributes as DenonAVR,
+    or None if there is no snapshot for the host that is newer than
+    max_age seconds.
+    """
+
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # the snapshot may be corrupted or come from a different version
+    if not isinstance(data, dict) or data.get("host") != host:
+        return None
+    timestamp = data.get("timestamp")
+    state = data.get("state")
+    if (not isinstance(timestamp, (int, float)) or
+            isinstance(timestamp, bool) or
+            not isinstance(state, dict) or
+            any(k not in state for k in STATE_ATTRS)):
+        return None
+    if not 0 <= time.time() - timestamp <= max_age:
+        return None
+    return types.SimpleNamespace(**{k: state[k] for k in STATE_ATTRS})
+
+
+def invalidate_state(path: str) -> None:
+    """Remove AVR state snapshot"""
+
+    try:
+        os.unlink(path)
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+
+
+class StateSnapshot:
+    """
+    State snapshot hook for long-running commands
+
+    save() should be called after every successful update, and
+    invalidate() after every command that may have changed AVR state.
+    If saving is disabled (host cache is off), save() does nothing
+    but invalidate() still removes the existing snapshot, so that
+    --max-age readers do not get stale values.
+    """
+
+    def __init__(self, path: str, host: str, enabled: bool) -> None:
+        self.path = path
+        self.host = host
+        self.enabled = enabled
+
+    def save(self, avr: denonavr.DenonAVR) -> None:
+        """Save current AVR state, if enabled"""
+
+        if self.enabled:
+            save_state(self.path, self.host, avr)
+
+    def invalidate(self) -> None:
+        """Remove the snapshot"""
+
+        invalidate_state(self.path)
@@ -0,0 +1,145 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""HTTP transports for recording and replaying receiver traffic"""
+
+import asyncio
+import collections
+import json
+import time
+import typing
+
+import httpx
+
+
+def encode_body(data: bytes) -> str:
+    """Encode body for storing in JSON, preserving non-UTF-8 bytes"""
+    return data.decode("utf-8", "surrogateescape")
+
+
+def decode_body(data: str) -> bytes:
+    """Reverse encode_body()"""
+    return data.encode("utf-8", "surrogateescape")
+
+
+def request_key(method: str,
+                path: str,
+                request_body: str,
+                ) -> typing.Tuple[str, str, str]:
+    """Get the key used to match requests against recorded exchanges"""
+    return (method, path, request_body)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Transport recording all exchanges passing through it"""
+
+    def __init__(self,
+                 transport: typing.Optional[httpx.AsyncBaseTransport] = None,
+                 ) -> None:
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport()
+        self.transport = transport
+        self.exchanges = []
+        self.start = time.perf_counter()
+
+    async def handle_async_request(self,
+                                   request: httpx.Request,
+                                   ) -> httpx.Response:
+        await request.aread()
+        exchange = {
+            "method": request.method,
+            "url": str(request.url),
+            "path": request.url.raw_path.decode("ascii"),
+            "request_body": encode_body(request.content),
+        }
+        start = time.perf_counter()
+        exchange["start"] = start - self.start
+        try:
+            response = await self.transport.handle_async_request(request)
+            try:
+                # keep the original encoding, the client decodes it
+                body = b"".join([x async for x in response.stream])
+            finally:
+                await response.aclose()
+        except httpx.TransportError as e:
+            exchange["duration"] = time.perf_counter() - start
+            exchange["error"] = type(e).__name__
+            exchange["message"] = str(e)
+            self.exchanges.append(exchange)
+            raise
+
+        exchange["duration"] = time.perf_counter() - start
+        exchange["status"] = response.status_code
+        exchange["headers"] = [list(x) for x in response.headers.multi_items()]
+        exchange["body"] = encode_body(body)
+        self.exchanges.append(exchange)
+        return httpx.Response(status_code=response.status_code,
+                              headers=response.headers,
+                              content=body,
+                              request=request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+    def save(self, path: str, host: typing.Optional[str]) -> None:
+        """Save recorded exchanges into a JSON file"""
+
+        with open(path, "w") as f:
+            json.dump({"host": host, "exchanges": self.exchanges}, f,
+                      indent=2)
+            f.write("\n")
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Transport serving exchanges recorded by RecordingTransport
+
+    Requests are matched by method, path and body.  Subsequent identical
+    requests are served subsequent recorded responses, and the last one
+    is repeated once they are exhausted.  If timing is True, the recorded
+    response latencies are reproduced.
+    """
+
+    def __init__(self,
+                 exchanges: typing.List[dict],
+                 timing: bool = False,
+                 ) -> None:
+        self.timing = timing
+        self.queues = collections.defaultdict(collections.deque)
+        for exchange in exchanges:
+            self.queues[request_key(exchange["method"],
+                                    exchange["path"],
+                                    exchange["request_body"])].append(exchange)
+
+    async def handle_async_request(self,
+                                   request: httpx.Request,
+                                   ) -> httpx.Response:
+        await request.aread()
+        queue = self.queues.get(request_key(request.method,
+                                            request.url.raw_path.decode(
+                                                "ascii"),
+                                            encode_body(request.content)))
+        if not queue:
+            raise httpx.ConnectError(
+                f"No recorded response for {request.method} {request.url}",
+                request=request)
+        exchange = queue[0]
+        if len(queue) > 1:
+            queue.popleft()
+
+        if self.timing:
+            await asyncio.sleep(exchange["duration"])
+        if "error" in exchange:
+            exc_class = getattr(httpx, exchange["error"], httpx.TransportError)
+            raise exc_class(exchange["message"], request=request)
+        return httpx.Response(status_code=exchange["status"],
+                              headers=exchange["headers"],
+                              content=decode_body(exchange["body"]),
+                              request=request)
+
+
+def load_recording(path: str) -> dict:
+    """Load recording saved by RecordingTransport.save()"""
+
+    with open(path, "r") as f:
+        return json.load(f)
@@ -1,10 +1,37 @@
 # (c) 2022-2025 Michał Górny
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import contextlib
 import os
 import os.path
 import sys
 
+import pytest
+
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "mocked-lib"))
 os.environ["XDG_CACHE_HOME"] = "/dev/null"
+
+
+@contextlib.contextmanager
+def save_envvar(key):
+    old = os.environ.pop(key, None)
+    try:
+        yield
+    finally:
+        if old is not None:
+            os.environ[key] = old
+        else:
+            os.environ.pop(key, None)
+
+
+@pytest.fixture
+def save_cache_home():
+    with save_envvar("XDG_CACHE_HOME"):
+        yield
+
+
+@pytest.fixture
+def cache_home(tmp_path, save_cache_home):
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    yield tmp_path
@@ -7,6 +7,7 @@ from denonavr.exceptions import AvrNetworkError
 TEST_DATA = {
     "instance_counter": 0,
     "discovery_result": None,
+    "async_client_getter": None,
 }
 
 INITIAL_VALUES = {
@@ -26,6 +27,7 @@ class DenonAVR:
         self.hostname = host
         self.new_values = {}
         self.setup_called = False
+        self.async_client_getter = None
 
     async def async_mute(self, new_state):
         self.new_values["muted"] = new_state
@@ -58,10 +60,20 @@ class DenonAVR:
         assert isinstance(new_volume, float)
         self.new_values["volume"] = new_volume
 
+    def set_async_client_getter(self, async_client_getter):
+        TEST_DATA["async_client_getter"] = async_client_getter
+        self.async_client_getter = async_client_getter
+
     async def async_update(self):
         assert self.setup_called
         self.__dict__.update(self.new_values)
         self.new_values = {}
+        # a custom client represents a real receiver, so its state wins
+        if self.async_client_getter is not None:
+            response = await self.async_client_getter().get(
+                f"http://{self.hostname}/goform/status")
+            response.raise_for_status()
+            self.__dict__.update(response.json())
 
     async def async_volume_down(self):
         self.new_values["volume"] = self.volume - 0.5
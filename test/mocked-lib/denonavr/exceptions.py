@@ -1,5 +1,9 @@
 # (c) 2022-2025 Michał Górny
 # SPDX-License-Identifier: GPL-2.0-or-later
 
-class AvrNetworkError(Exception):
+class DenonAvrError(Exception):
+    pass
+
+
+class AvrNetworkError(DenonAvrError):
     pass
@@ -0,0 +1,19 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import xml.etree.ElementTree as ET
+
+from urllib.parse import urlparse
+
+
+def evaluate_scpd_xml(url, body):
+    device = ET.fromstring(body).find("device")
+    if device.findtext("manufacturer") != "Denon":
+        return None
+    return {
+        "manufacturer": device.findtext("manufacturer"),
+        "host": urlparse(url).hostname,
+        "modelName": device.findtext("modelName"),
+        "serialNumber": device.findtext("serialNumber"),
+        "friendlyName": device.findtext("friendlyName"),
+    }
@@ -1,6 +1,7 @@
 # (c) 2022-2025 Michał Górny
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import asyncio
 import contextlib
 
 from typing import Any
@@ -8,7 +9,9 @@ from unittest import mock
 
 import pytest
 
-from denonavr_cli.__main__ import main
+from denonavr_cli.__main__ import (AsyncioConsole, main,
+                                   refresh_periodically)
+from denonavr_cli.state import StateSnapshot
 from denonavr import INITIAL_VALUES, TEST_DATA
 
 
@@ -90,7 +93,7 @@ class TestSoundMode(DataCommandTest):
 
     async def test_set_fail(self, capsys):
         # mock sleep out not to waste time
-        with mock.patch("time.sleep"):
+        with mock.patch("asyncio.sleep"):
             await self.run("FAKE", expected=1)
         assert capsys.readouterr().out == "MCH STEREO\n"
 
@@ -155,9 +158,6 @@ class TestShell(CommandTest):
         assert (self.imported_modules.keys() ==
                 frozenset(self.successful_imports))
 
-    async def test_shell_implicit(self):
-        await self.run_shell()
-
     async def test_shell_explicit(self):
         await self.run_shell(f"--shell={self.shell}")
 
@@ -166,12 +166,16 @@ class TestPythonShell(TestShell):
     __test__ = True
 
     shell = "python"
-    successful_imports = ["code"]
+    successful_imports = []
+
+    async def test_shell_implicit(self):
+        await self.run_shell()
 
     async def run_shell(self, *args):
-        await self.run(*args)
-        (self.imported_modules["code"].InteractiveConsole().interact
-            .assert_called())
+        with mock.patch.object(AsyncioConsole, "raw_input",
+                               side_effect=EOFError) as raw_input:
+            await self.run(*args)
+        raw_input.assert_called()
 
 
 class TestIPythonShell(TestShell):
@@ -184,3 +188,92 @@ class TestIPythonShell(TestShell):
         await self.run(*args)
         self.imported_modules["IPython"].embed.assert_called()
         self.imported_modules["nest_asyncio"].apply.assert_called()
+
+
+class TestAsyncioConsole(CommandTest):
+    command = "shell"
+
+    async def run_lines(self, *lines):
+        with mock.patch.object(AsyncioConsole, "raw_input",
+                               side_effect=list(lines) + [EOFError]):
+            await self.run("--shell=python")
+
+    async def test_await(self, capsys):
+        await self.run_lines("await avr.async_volume_up()",
+                             "await avr.async_update()",
+                             "print(avr.volume)")
+        assert capsys.readouterr().out == "-45.0\n"
+
+    async def test_commands(self, capsys):
+        await self.run_lines("volume up 2",
+                             "sound-mode MOVIE",
+                             "mute toggle",
+                             "print(avr.volume, avr.sound_mode, avr.muted)")
+        assert capsys.readouterr().out.splitlines() == [
+            "-43.5",
+            "MOVIE",
+            "True",
+            "-43.5 MOVIE True",
+        ]
+
+    async def test_command_error(self, capsys):
+        await self.run_lines("volume set",
+                             "power")
+        capture = capsys.readouterr()
+        assert capture.out == "ON\n"
+        assert "New volume needs to be provided" in capture.err
+
+    async def test_python_precedence(self, capsys):
+        await self.run_lines("power = 5",
+                             "print(power)")
+        assert capsys.readouterr().out == "5\n"
+
+    async def test_traceback(self, capsys):
+        await self.run_lines("nonexistent_name")
+        err = capsys.readouterr().err
+        assert "NameError" in err
+        assert 'File "<console>", line 1' in err
+        assert "run_in_loop" not in err
+        assert "concurrent" not in err
+
+    async def test_snapshot_invalidation(self, capsys):
+        with mock.patch.object(StateSnapshot, "invalidate",
+                               autospec=True) as invalidate:
+            await self.run_lines("power",
+                                 "volume",
+                                 "mute on",
+                                 "print(avr.muted)")
+            # after "mute on", the Python line and the shell itself
+            assert invalidate.call_count == 3
+
+    async def test_exit(self, capsys):
+        await self.run_lines("exit()",
+                             "print('not reached')")
+        assert capsys.readouterr().out == ""
+
+
+async def test_refresh_survives_errors(capsys):
+    avr = mock.MagicMock()
+    avr.async_update = mock.AsyncMock(
+        side_effect=[TimeoutError("timed out"), None, None, None])
+    task = asyncio.ensure_future(refresh_periodically(avr, 0))
+    for attempt in range(10):
+        await asyncio.sleep(0)
+    assert not task.done()
+    task.cancel()
+    assert avr.async_update.call_count > 1
+    assert ("Status update failed: TimeoutError('timed out')" in
+            capsys.readouterr().err)
+
+
+async def test_refresh_saves_snapshot():
+    avr = mock.MagicMock()
+    avr.async_update = mock.AsyncMock(
+        side_effect=[TimeoutError("timed out")] + [None] * 20)
+    snapshot = mock.MagicMock()
+    task = asyncio.ensure_future(refresh_periodically(avr, 0, snapshot))
+    for attempt in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+    assert snapshot.save.call_count == avr.async_update.call_count - 1
+    snapshot.save.assert_called_with(avr)
@@ -1,6 +1,7 @@
 # (c) 2022-2025 Michał Górny
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import asyncio
 import contextlib
 import os
 
@@ -8,6 +9,8 @@ from unittest import mock
 
 import pytest
 
+import denonavr_cli.scan
+
 from denonavr_cli.__main__ import main
 from denonavr import TEST_DATA
 
@@ -150,6 +153,86 @@ class TwoAVRsDiscoveryTest(DiscoveryTest):
         assert "Autodiscovery found multiple receivers" in capture.err
 
 
+DESCRIPTION_XML = """<?xml version="1.0"?>
+<root>
+  <device>
+    <manufacturer>Denon</manufacturer>
+    <modelName>Scanned AVR</modelName>
+    <serialNumber>SC4N1234567890</serialNumber>
+    <friendlyName>My Scanned AVR</friendlyName>
+  </device>
+</root>
+"""
+
+
+@pytest.fixture
+async def description_server():
+    async def handle(reader, writer):
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        if request.split()[1] == b"/description.xml":
+            writer.write(b"HTTP/1.0 200 OK\r\n\r\n" +
+                         DESCRIPTION_XML.encode())
+        else:
+            writer.write(b"HTTP/1.0 404 Not Found\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    with mock.patch.object(denonavr_cli.scan, "DESCRIPTION_URLS",
+                           [(port, "/description.xml"),
+                            (port, "/other.xml")]):
+        async with server:
+            yield
+
+
+class ScanDiscoveryTest(DiscoveryTest):
+    __test__ = True
+
+    # SSDP discovery must not be used
+    discovery_result = None
+
+    async def test_scan(self, capsys, description_server):
+        await self.run(args=["discover", "--scan", "127.0.0.0/29"])
+        assert capsys.readouterr().out.splitlines() == [
+            "127.0.0.1       My Scanned AVR (Scanned AVR SC4N1234567890)",
+        ]
+
+    async def test_hosts_file(self, capsys, description_server, tmp_path):
+        with open(tmp_path / "hosts", "w") as f:
+            f.write("# test hosts\n127.0.0.2\n\n127.0.0.1  # AVR\n")
+        await self.run(args=["discover", "--hosts-file",
+                             str(tmp_path / "hosts")])
+        assert capsys.readouterr().out.splitlines() == [
+            "127.0.0.1       My Scanned AVR (Scanned AVR SC4N1234567890)",
+        ]
+
+    async def test_missing_hosts_file(self, capsys, tmp_path):
+        await self.run(args=["discover", "--hosts-file",
+                             str(tmp_path / "nonexistent")],
+                       expected_exit=2)
+        assert "Unable to read hosts file" in capsys.readouterr().err
+
+    async def test_nothing_found(self, capsys, description_server):
+        await self.run(args=["discover", "--scan", "127.0.0.2/32"],
+                       expected_exit=1)
+        capture = capsys.readouterr()
+        assert capture.out == ""
+        assert "No AVRs discovered" in capture.err
+
+    async def test_large_network(self, capsys):
+        await self.run(args=["discover", "--scan", "10.0.0.0/8"],
+                       expected_exit=2)
+        assert "too large to scan" in capsys.readouterr().err
+
+    async def test_bad_network(self, capsys):
+        await self.run(args=["discover", "--scan", "127.0.0.300/24"],
+                       expected_exit=2)
+        assert "invalid network value" in capsys.readouterr().err
+
+
 class ValidHostCacheTests:
     __test__ = True
 
@@ -0,0 +1,146 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import asyncio
+import contextlib
+import socket
+
+from unittest import mock
+
+import pytest
+
+from denonavr_cli.__main__ import main
+from denonavr_cli.exporter import Metrics
+from denonavr import DenonAVR, TEST_DATA
+from denonavr.exceptions import AvrNetworkError
+
+
+@pytest.fixture
+async def avr():
+    avr = DenonAVR("mocked-host")
+    await avr.async_setup()
+    await avr.async_update()
+    return avr
+
+
+def samples(text):
+    return [x for x in text.splitlines() if not x.startswith("#")]
+
+
+async def test_render(avr):
+    metrics = Metrics(avr)
+    metrics.last_update = 1234.5
+    await metrics.update()
+    metrics.last_update = 1234.5
+    with mock.patch.object(avr, "async_update", side_effect=AvrNetworkError):
+        await metrics.update()
+    out = samples(metrics.render())
+    assert out[:7] == [
+        "denonavr_up 0",
+        "denonavr_last_update_timestamp_seconds 1234.5",
+        "denonavr_power 1",
+        "denonavr_volume_db -45.5",
+        "denonavr_muted 0",
+        'denonavr_input_info{input="Game"} 1',
+        'denonavr_sound_mode_info{sound_mode="MCH STEREO"} 1',
+    ]
+    assert 'denonavr_update_duration_seconds_bucket{le="+Inf"} 2' in out
+    assert "denonavr_update_duration_seconds_count 2" in out
+    assert out[-1] == 'denonavr_update_errors_total{type="AvrNetworkError"} 1'
+
+
+async def test_unexpected_error(avr):
+    metrics = Metrics(avr)
+    with mock.patch.object(avr, "async_update", side_effect=KeyError("x")):
+        await metrics.update()
+    out = samples(metrics.render())
+    assert "denonavr_up 0" in out
+    assert out[-1] == 'denonavr_update_errors_total{type="KeyError"} 1'
+
+
+async def test_refresh_survives_errors(avr):
+    metrics = Metrics(avr)
+    errors = [KeyError("x")]
+
+    async def update():
+        if errors:
+            raise errors.pop()
+
+    with mock.patch.object(avr, "async_update", new=update):
+        task = asyncio.ensure_future(metrics.refresh_periodically(0))
+        for attempt in range(10):
+            await asyncio.sleep(0)
+        assert not task.done()
+        task.cancel()
+    assert metrics.up
+    assert metrics.update_count > 1
+    assert metrics.update_errors == {"KeyError": 1}
+
+
+async def test_save_snapshot(avr, capsys):
+    snapshot = mock.MagicMock()
+    metrics = Metrics(avr, snapshot)
+    await metrics.update()
+    snapshot.save.assert_called_once_with(avr)
+    with mock.patch.object(avr, "async_update", side_effect=AvrNetworkError):
+        await metrics.update()
+    snapshot.save.assert_called_once_with(avr)
+
+    snapshot.save.side_effect = PermissionError("denied")
+    await metrics.update()
+    assert metrics.up
+    assert ("Unable to save state snapshot: denied" in
+            capsys.readouterr().err)
+
+
+async def test_label_escaping(avr):
+    avr.input_func = 'a "b"\\c'
+    assert ('denonavr_input_info{input="a \\"b\\"\\\\c"} 1'
+            in samples(Metrics(avr).render()))
+
+
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.0\r\nHost: localhost\r\n\r\n"
+                 .encode("ascii"))
+    data = await reader.read()
+    writer.close()
+    return data.decode("utf-8")
+
+
+async def test_serve():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    TEST_DATA["instance_counter"] = 0
+    task = asyncio.ensure_future(
+        main(["denonavr-cli", "--host-cache", "off", "--host", "mocked-host",
+              "exporter", "--address", "127.0.0.1", "--port", str(port)]))
+    for attempt in range(50):
+        try:
+            response = await fetch(port, "/metrics")
+        except ConnectionError:
+            await asyncio.sleep(0.01)
+        else:
+            break
+    else:
+        task.cancel()
+        pytest.fail("Exporter did not start listening")
+    try:
+        assert response.startswith("HTTP/1.0 200 OK\r\n")
+        assert "\ndenonavr_power 1\n" in response
+        assert (await fetch(port, "/")).startswith("HTTP/1.0 404 ")
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    assert TEST_DATA["instance_counter"] == 1
+
+
+@pytest.mark.parametrize("interval", ["0", "-1", "nan"])
+async def test_invalid_interval(capsys, interval):
+    with pytest.raises(SystemExit):
+        await main(["denonavr-cli", "--host-cache", "off", "--host",
+                    "mocked-host", "exporter", "--interval", interval])
+    assert "must be positive" in capsys.readouterr().err
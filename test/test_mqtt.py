@@ -0,0 +1,306 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import asyncio
+import types
+import uuid
+
+from unittest import mock
+
+import pytest
+
+from denonavr_cli.__main__ import main
+from denonavr_cli.mqtt import Bridge
+from denonavr import DenonAVR, TEST_DATA
+
+
+class FakeClient:
+    def __init__(self, hostname, port, *, username, password, will):
+        self.hostname = hostname
+        self.port = port
+        self.will = will
+        self.published = []
+        self.subscribed = []
+        self.incoming = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def publish(self, topic, payload, qos, retain):
+        assert retain
+        self.published.append((topic, payload))
+
+    async def subscribe(self, topic, qos):
+        self.subscribed.append(topic)
+
+    @property
+    async def messages(self):
+        for topic, payload in self.incoming:
+            yield types.SimpleNamespace(topic=types.SimpleNamespace(
+                                            value=topic),
+                                        payload=payload)
+        # wait for debounced commands
+        await asyncio.sleep(0.05)
+
+
+@pytest.fixture
+async def avr():
+    avr = DenonAVR("mocked-host")
+    await avr.async_setup()
+    await avr.async_update()
+    return avr
+
+
+@pytest.fixture
+async def bridge(avr):
+    bridge = Bridge(avr, FakeClient("localhost", 1883, username=None,
+                                    password=None, will=None),
+                    "avr", debounce=0.01)
+    await bridge.publish_state()
+    bridge.client.published.clear()
+    yield bridge
+    bridge.cancel_pending()
+
+
+async def send(bridge, *messages):
+    for topic, payload in messages:
+        bridge.handle_message(topic, payload)
+    await asyncio.sleep(0.05)
+
+
+async def test_publish_changes_only(bridge):
+    await bridge.update()
+    assert bridge.client.published == []
+    await send(bridge, ("avr/mute/set", "on"))
+    assert bridge.client.published == [("avr/mute", "True")]
+
+
+async def test_volume_coalescing(bridge):
+    await send(bridge,
+               ("avr/volume/set", "up"),
+               ("avr/volume/set", "up 2"),
+               ("avr/volume/set", "down 1"))
+    assert bridge.client.published == [("avr/volume", "-44.0")]
+
+
+async def test_volume_set_coalescing(bridge):
+    await send(bridge,
+               ("avr/volume/set", "-30"),
+               ("avr/volume/set", "-20"),
+               ("avr/volume/set", "up"))
+    assert bridge.client.published == [("avr/volume", "-19.5")]
+
+
+async def test_toggle_coalescing(bridge):
+    await send(bridge,
+               ("avr/power/set", "toggle"),
+               ("avr/power/set", "toggle"),
+               ("avr/mute/set", "toggle"))
+    assert bridge.client.published == [("avr/mute", "True")]
+
+
+async def test_sound_mode(bridge):
+    await send(bridge,
+               ("avr/sound-mode/set", "MUSIC"),
+               ("avr/sound-mode/set", "MOVIE"))
+    assert bridge.client.published == [("avr/sound-mode", "MOVIE")]
+
+
+async def test_invalid(bridge, capsys):
+    await send(bridge,
+               ("avr/mute/set", "maybe"),
+               ("avr/volume/set", "louder"),
+               ("avr/foo/set", "on"),
+               ("other/mute/set", "on"),
+               ("avr/mute", "on"))
+    assert bridge.client.published == []
+    assert capsys.readouterr().err.splitlines() == [
+        "Invalid mute value: 'maybe'",
+        "Invalid volume value: 'louder'",
+    ]
+
+
+@pytest.mark.parametrize("payload", ["nan", "inf", "-inf", "up inf",
+                                     "set nan"])
+async def test_non_finite_volume(bridge, capsys, payload):
+    await send(bridge, ("avr/volume/set", payload))
+    assert bridge.client.published == []
+    assert (capsys.readouterr().err ==
+            f"Invalid volume value: {payload!r}\n")
+
+
+async def test_execute_error(bridge, capsys):
+    bridge.avr.volume = None
+    await send(bridge, ("avr/volume/set", "up"))
+    assert "volume failed: TypeError" in capsys.readouterr().err
+    # the bridge keeps working
+    await send(bridge, ("avr/mute/set", "on"))
+    assert bridge.client.published == [("avr/mute", "True"),
+                                       ("avr/volume", "None")]
+
+
+async def test_refresh_survives_errors(bridge, capsys):
+    async def failing_publish(*args, **kwargs):
+        raise RuntimeError("broker gone")
+
+    bridge.avr.new_values["muted"] = True
+    with mock.patch.object(bridge.client, "publish", new=failing_publish):
+        task = asyncio.ensure_future(bridge.refresh_periodically(0))
+        for attempt in range(10):
+            await asyncio.sleep(0)
+        assert not task.done()
+    for attempt in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+    assert "Update failed: RuntimeError('broker gone')" in (
+        capsys.readouterr().err)
+    assert bridge.client.published == [("avr/mute", "True")]
+
+
+async def test_snapshot(bridge):
+    bridge.snapshot = mock.MagicMock()
+    await bridge.update()
+    bridge.snapshot.save.assert_called_once_with(bridge.avr)
+    bridge.snapshot.invalidate.assert_not_called()
+    await send(bridge, ("avr/mute/set", "on"))
+    bridge.snapshot.invalidate.assert_called_once_with()
+
+
+async def test_main():
+    clients = []
+
+    def make_client(*args, **kwargs):
+        client = FakeClient(*args, **kwargs)
+        client.incoming = [("denonavr/volume/set", b"set -40"),
+                           ("denonavr/volume/set", b"up")]
+        clients.append(client)
+        return client
+
+    aiomqtt = mock.MagicMock()
+    aiomqtt.Client = make_client
+    TEST_DATA["instance_counter"] = 0
+    with mock.patch("importlib.import_module", return_value=aiomqtt):
+        assert await main(["denonavr-cli", "--host-cache", "off",
+                           "--host", "mocked-host", "mqtt",
+                           "--broker", "mqtt-host", "--debounce", "0.01"]
+                          ) == 0
+    assert TEST_DATA["instance_counter"] == 1
+
+    client, = clients
+    assert client.hostname == "mqtt-host"
+    aiomqtt.Will.assert_called_with("denonavr/available", "offline",
+                                    qos=1, retain=True)
+    assert client.subscribed == ["denonavr/+/set"]
+    assert client.published == [
+        ("denonavr/available", "online"),
+        ("denonavr/input", "Game"),
+        ("denonavr/mute", "False"),
+        ("denonavr/power", "ON"),
+        ("denonavr/sound-mode", "MCH STEREO"),
+        ("denonavr/volume", "-45.5"),
+        ("denonavr/volume", "-39.5"),
+        ("denonavr/available", "offline"),
+    ]
+
+
+async def test_main_no_aiomqtt(capsys):
+    with mock.patch("importlib.import_module",
+                    side_effect=ModuleNotFoundError("aiomqtt")):
+        with pytest.raises(SystemExit):
+            await main(["denonavr-cli", "--host-cache", "off",
+                        "--host", "mocked-host", "mqtt"])
+    assert "requires the aiomqtt package" in capsys.readouterr().err
+
+
+class BlockingClient(FakeClient):
+    @property
+    async def messages(self):
+        await asyncio.Event().wait()
+        yield
+
+
+async def test_main_offline_on_cancel():
+    clients = []
+
+    def make_client(*args, **kwargs):
+        client = BlockingClient(*args, **kwargs)
+        clients.append(client)
+        return client
+
+    aiomqtt = mock.MagicMock()
+    aiomqtt.Client = make_client
+    with mock.patch("importlib.import_module", return_value=aiomqtt):
+        task = asyncio.ensure_future(
+            main(["denonavr-cli", "--host-cache", "off",
+                  "--host", "mocked-host", "mqtt"]))
+        for attempt in range(50):
+            await asyncio.sleep(0.01)
+            if clients and clients[0].published[-1:] == [
+                    ("denonavr/volume", "-45.5")]:
+                break
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    client, = clients
+    assert client.published[0] == ("denonavr/available", "online")
+    assert client.published[-1] == ("denonavr/available", "offline")
+
+
+@pytest.mark.parametrize("interval", ["0", "-1"])
+async def test_invalid_interval(capsys, interval):
+    with pytest.raises(SystemExit):
+        await main(["denonavr-cli", "--host-cache", "off",
+                    "--host", "mocked-host", "mqtt", "--interval", interval])
+    assert "must be positive" in capsys.readouterr().err
+
+
+@pytest.fixture
+async def broker():
+    aiomqtt = pytest.importorskip("aiomqtt")
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection("localhost", 1883), 1)
+    except (OSError, asyncio.TimeoutError):
+        pytest.skip("no MQTT broker on localhost:1883")
+    writer.close()
+    return aiomqtt
+
+
+async def test_broker(broker):
+    prefix = f"denonavr-cli-test/{uuid.uuid4()}"
+
+    async with broker.Client("localhost", 1883) as observer:
+        await observer.subscribe(f"{prefix}/#", qos=1)
+        messages = observer.messages
+
+        async def expect(topic, payload):
+            async def wait():
+                async for message in messages:
+                    if (message.topic.value == f"{prefix}/{topic}" and
+                            message.payload == payload):
+                        return
+            await asyncio.wait_for(wait(), 5)
+
+        task = asyncio.ensure_future(
+            main(["denonavr-cli", "--host-cache", "off",
+                  "--host", "mocked-host", "mqtt", "--broker", "localhost",
+                  "--topic-prefix", prefix, "--debounce", "0.01"]))
+        try:
+            await expect("available", b"online")
+            await expect("mute", b"False")
+            await observer.publish(f"{prefix}/mute/set", "on", qos=1)
+            await expect("mute", b"True")
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        await expect("available", b"offline")
+
+        # clean up retained messages
+        for topic in ("available",) + Bridge.COMMANDS:
+            await observer.publish(f"{prefix}/{topic}", b"", qos=1,
+                                   retain=True)
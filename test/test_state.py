@@ -0,0 +1,126 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import json
+import os
+import time
+
+import pytest
+
+from denonavr_cli.__main__ import main
+from denonavr import TEST_DATA
+
+
+async def run(*args, expected_instances):
+    TEST_DATA["instance_counter"] = 0
+    assert await main(["denonavr-cli"] + list(args)) == 0
+    assert TEST_DATA["instance_counter"] == expected_instances
+
+
+def write_state(path, host="mocked-host", age=0, **state):
+    with open(path / "denonavr-cli.state", "w") as f:
+        json.dump({
+            "host": host,
+            "timestamp": time.time() - age,
+            "state": dict({
+                "input_func": "AUX",
+                "input_func_list": ["AUX"],
+                "muted": True,
+                "power": "ON",
+                "sound_mode": "MUSIC",
+                "sound_mode_list": ["MUSIC"],
+                "volume": -30.0,
+            }, **state),
+        }, f)
+
+
+async def test_save_state(cache_home, capsys):
+    await run("--host", "mocked-host", "volume", expected_instances=1)
+    await run("--host", "mocked-host", "--max-age", "60", "volume",
+              expected_instances=0)
+    await run("--max-age", "60", "sound-mode", expected_instances=0)
+    await run("--max-age", "60", expected_instances=0)
+    assert capsys.readouterr().out.splitlines() == [
+        "-45.5",
+        "-45.5",
+        "MCH STEREO",
+        "Power: ON       Volume: -45.5 dB         Input: Game",
+    ]
+
+
+async def test_fresh_state(cache_home, capsys):
+    write_state(cache_home, age=5)
+    await run("--host", "mocked-host", "--max-age", "10", "mute",
+              expected_instances=0)
+    assert capsys.readouterr().out == "True\n"
+
+
+async def test_stale_state(cache_home, capsys):
+    write_state(cache_home, age=15)
+    await run("--host", "mocked-host", "--max-age", "10", "mute",
+              expected_instances=1)
+    assert capsys.readouterr().out == "False\n"
+
+
+async def test_other_host_state(cache_home, capsys):
+    write_state(cache_home, host="other-host")
+    await run("--host", "mocked-host", "--max-age", "10", "mute",
+              expected_instances=1)
+    assert capsys.readouterr().out == "False\n"
+
+
+async def test_no_max_age(cache_home, capsys):
+    write_state(cache_home)
+    await run("--host", "mocked-host", "mute", expected_instances=1)
+    assert capsys.readouterr().out == "False\n"
+
+
+async def test_reset(cache_home, capsys):
+    write_state(cache_home)
+    await run("--host", "mocked-host", "--host-cache=reset", "--max-age",
+              "10", "mute", expected_instances=1)
+    assert capsys.readouterr().out == "False\n"
+
+
+async def test_write_invalidates(cache_home, capsys):
+    write_state(cache_home)
+    await run("--host", "mocked-host", "--max-age", "10", "mute", "on",
+              expected_instances=1)
+    assert capsys.readouterr().out == "True\n"
+    assert not os.path.exists(cache_home / "denonavr-cli.state")
+
+
+async def test_write_invalidates_without_host_cache(cache_home, capsys):
+    await run("--host", "mocked-host", "mute", expected_instances=1)
+    await run("--host-cache=off", "--host", "mocked-host", "mute", "on",
+              expected_instances=1)
+    assert not os.path.exists(cache_home / "denonavr-cli.state")
+    await run("--host", "mocked-host", "--max-age", "60", "mute",
+              expected_instances=1)
+
+
+async def test_no_host_cache_does_not_save(cache_home):
+    await run("--host-cache=off", "--host", "mocked-host", "mute",
+              expected_instances=1)
+    assert not os.path.exists(cache_home / "denonavr-cli.state")
+
+
+@pytest.mark.parametrize("data",
+                         [[],
+                          {"host": "mocked-host", "timestamp": "now",
+                           "state": {}},
+                          {"host": "mocked-host", "timestamp": None},
+                          {"host": "mocked-host", "timestamp": time.time(),
+                           "state": []},
+                          {"host": "mocked-host", "timestamp": time.time(),
+                           "state": {"volume": -30.0}},
+                          ])
+async def test_malformed_state(cache_home, capsys, data):
+    with open(cache_home / "denonavr-cli.state", "w") as f:
+        json.dump(data, f)
+    await run("--host", "mocked-host", "--max-age", "10", "mute",
+              expected_instances=1)
+    assert capsys.readouterr().out == "False\n"
+    # the snapshot is replaced by a valid one
+    await run("--host", "mocked-host", "--max-age", "10", "mute",
+              expected_instances=0)
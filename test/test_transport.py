@@ -0,0 +1,149 @@
+# (c) 2022-2025 Michał Górny
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import json
+import time
+
+from unittest import mock
+
+import httpx
+import pytest
+
+from denonavr_cli.__main__ import main
+from denonavr_cli.transport import (load_recording, RecordingTransport,
+                                    ReplayTransport)
+
+
+def mocked_receiver(request):
+    if request.url.path == "/fail":
+        raise httpx.ConnectTimeout("timed out", request=request)
+    if request.method == "POST":
+        return httpx.Response(200, content=b"<reply>" + request.content
+                              + b"</reply>")
+    return httpx.Response(200, content=f"<{request.url.path[1:]}/>\xff"
+                          .encode("latin1"))
+
+
+@pytest.fixture
+async def recording(tmp_path):
+    transport = RecordingTransport(httpx.MockTransport(mocked_receiver))
+    async with httpx.AsyncClient(transport=transport) as client:
+        assert (await client.get("http://avr/a")).content == b"<a/>\xff"
+        assert (await client.post("http://avr/cmd", content=b"X")
+                ).content == b"<reply>X</reply>"
+        assert (await client.get("http://avr/b")).content == b"<b/>\xff"
+        with pytest.raises(httpx.ConnectTimeout):
+            await client.get("http://avr/fail")
+    transport.save(tmp_path / "recording.json", "avr")
+    return tmp_path / "recording.json"
+
+
+async def test_record(recording):
+    data = load_recording(recording)
+    assert data["host"] == "avr"
+    assert [(x["method"], x["url"], x.get("status"), x.get("error"))
+            for x in data["exchanges"]] == [
+        ("GET", "http://avr/a", 200, None),
+        ("POST", "http://avr/cmd", 200, None),
+        ("GET", "http://avr/b", 200, None),
+        ("GET", "http://avr/fail", None, "ConnectTimeout"),
+    ]
+    assert all(x["duration"] >= 0 for x in data["exchanges"])
+
+
+async def test_replay(recording):
+    transport = ReplayTransport(load_recording(recording)["exchanges"])
+    # host is irrelevant for matching
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://other-host") as client:
+        for attempt in range(2):
+            assert (await client.get("/b")).content == b"<b/>\xff"
+            assert (await client.get("/a")).content == b"<a/>\xff"
+        assert (await client.post("/cmd", content=b"X")
+                ).content == b"<reply>X</reply>"
+        with pytest.raises(httpx.ConnectTimeout):
+            await client.get("/fail")
+        with pytest.raises(httpx.ConnectError):
+            await client.post("/cmd", content=b"Y")
+        with pytest.raises(httpx.ConnectError):
+            await client.get("/c")
+
+
+async def test_replay_sequence():
+    exchanges = [
+        {"method": "GET", "path": "/x", "request_body": "", "duration": 0,
+         "status": 200, "headers": [], "body": str(i)}
+        for i in range(3)
+    ]
+    transport = ReplayTransport(exchanges)
+    async with httpx.AsyncClient(transport=transport) as client:
+        assert [(await client.get("http://avr/x")).text
+                for i in range(5)] == ["0", "1", "2", "2", "2"]
+
+
+async def test_replay_timing():
+    exchanges = [
+        {"method": "GET", "path": "/x", "request_body": "", "duration": 0.1,
+         "status": 200, "headers": [], "body": ""},
+    ]
+    transport = ReplayTransport(exchanges, timing=True)
+    async with httpx.AsyncClient(transport=transport) as client:
+        start = time.perf_counter()
+        await client.get("http://avr/x")
+        assert time.perf_counter() - start >= 0.1
+
+
+def mocked_status(request):
+    assert request.url == "http://mocked-host/goform/status"
+    return httpx.Response(200, json={"volume": -20.0, "muted": True})
+
+
+async def test_main_record_replay(tmp_path, capsys):
+    recording = str(tmp_path / "recording.json")
+    with mock.patch("httpx.AsyncHTTPTransport",
+                    return_value=httpx.MockTransport(mocked_status)):
+        assert await main(["denonavr-cli", "--host-cache=off",
+                           "--host", "mocked-host", "--record", recording,
+                           "volume"]) == 0
+    assert capsys.readouterr().out == "-20.0\n"
+    assert [(x["method"], x["url"], json.loads(x["body"]))
+            for x in load_recording(recording)["exchanges"]] == [
+        ("GET", "http://mocked-host/goform/status",
+         {"volume": -20.0, "muted": True}),
+    ]
+
+    # the recorded responses must be served without network access
+    with mock.patch("httpx.AsyncHTTPTransport", side_effect=AssertionError):
+        assert await main(["denonavr-cli", "--replay", recording,
+                           "mute"]) == 0
+    assert capsys.readouterr().out == "True\n"
+
+
+async def test_main_replay_unknown_request(tmp_path):
+    with open(tmp_path / "recording.json", "w") as f:
+        json.dump({"host": "mocked-host", "exchanges": []}, f)
+    with pytest.raises(httpx.ConnectError):
+        await main(["denonavr-cli", "--replay",
+                    str(tmp_path / "recording.json"), "volume"])
+
+
+@pytest.mark.parametrize("content", [None, "{}", "[]", "not json"])
+async def test_main_bad_recording(tmp_path, capsys, content):
+    if content is not None:
+        with open(tmp_path / "recording.json", "w") as f:
+            f.write(content)
+    with pytest.raises(SystemExit):
+        await main(["denonavr-cli", "--replay",
+                    str(tmp_path / "recording.json"), "volume"])
+    assert "Unable to load recording" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("args,message",
+                         [(["--replay-timing"], "requires --replay"),
+                          (["--replay", "foo.json", "discover"],
+                           "discover cannot be used with --replay"),
+                          ])
+async def test_main_invalid_args(capsys, args, message):
+    with pytest.raises(SystemExit):
+        await main(["denonavr-cli"] + args)
+    assert message in capsys.readouterr().err